@@ -1,10 +1,14 @@
 import shelve
 import os
+import heapq
 from utils.config import Config
+from utils.kvstore import KVStore
+from crawler.skip import read_skip_log
 from configparser import ConfigParser
 from argparse import ArgumentParser
 from collections import defaultdict
-from urllib.parse import urlparse, urlunparse
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
 
 class SaveChecker:
@@ -22,108 +26,108 @@ class SaveChecker:
         else:  # Load existing save file, or create one if it does not exist.
             self.frontier_save = shelve.open(self.frontier_save_file)
 
-        if not os.path.exists(self.max_save_file + ".dat"):
+        if not os.path.exists(self.max_save_file):
             # Save file does not exist, but request to load save.
             print("max_save_file does not exist")
             self.max_save = None
 
         else:  # Load existing save file, or create one if it does not exist.
-            self.max_save = shelve.open(self.max_save_file)
+            self.max_save = KVStore(self.max_save_file)
 
-        if not os.path.exists(self.token_save_file + ".dat"):
+        if not os.path.exists(self.token_save_file):
             # Save file does not exist, but request to load save.
             print("token_save_file does not exist")
             self.token_save = None
 
         else:  # Load existing save file, or create one if it does not exist.
-            self.token_save = shelve.open(self.token_save_file)
+            self.token_save = KVStore(self.token_save_file)
 
-        if not os.path.exists(self.skip_save_file + ".dat"):
+        if not os.path.exists(self.skip_save_file):
             # Save file does not exist, but request to load save.
             print("skip_save_file does not exist")
             self.skip_save = None
 
-        else:  # Load existing save file, or create one if it does not exist.
-            self.skip_save = shelve.open(self.skip_save_file)
+        else:  # Load existing save file into a dictionary of url hash -> url.
+            self.skip_save = dict(read_skip_log(self.skip_save_file))
 
     def longest_page(self):
         return (self.max_save["url"], self.max_save["max_words"])
 
     def common_words(self):
-        # Sorting the dictionary by value and storing it as a list of tuples (key, value)
-        mostFrequent = sorted(self.token_save.items(), key=lambda x: x[1], reverse=True)
-
-        # If the dictionary has 50 or fewer items, return them all
-        if len(mostFrequent) <= 50:
-            return dict(mostFrequent)  # Convert list of tuples back to dictionary for consistency
-        else:
-            # Return the first 50 elements as a dictionary
-            return dict(mostFrequent[:50])
-
-    def _normalize_url(self, url):
-        """Normalize a URL by removing the fragment part"""
-        parsed_url = urlparse(url)
-        return urlunparse(parsed_url._replace(fragment=""))
-
-    def unique_pages(self):
-        """Check for unique pages in the frontier save and returns the count of unique pages"""
-        unique_urls = set()
-        urls = [url_tuple[0] for url_tuple in self.frontier_save.values()]
-        skipped = set(self.skip_save.values())
+        # Keep the 50 most frequent tokens with a bounded heap instead of sorting every token,
+        # returned as a dictionary of (key, value) in descending order
+        return dict(heapq.nlargest(50, self.token_save.items(), key=lambda x: x[1]))
 
-        for url in urls:
-            if not url in skipped:
-                normalized_url = self._normalize_url(url)
-                unique_urls.add(normalized_url)
-        return len(unique_urls)
+    def _normalize_url(self, parsed_url):
+        """Normalize a parsed URL by removing the fragment part"""
+        return parsed_url._replace(fragment="").geturl()
 
-    def count_subdomains(self):
+    def _scan_frontier(self):
         """
-        Count unique subdomains across ALL allowed domains.
-        Returns: list of strings like "subdomain, count"
+        Walks the frontier save once, parsing every url a single time, and computes both the count of
+        unique pages and the pages per subdomain.
+        Returns: (count of unique pages, list of strings like "subdomain, count")
         """
+        unique_urls = set()
         subdomains = defaultdict(set)
+        skipped = set(self.skip_save.values())
 
         # frontier_save values look like: (url, completed_flag)
-        urls = [url_tuple[0] for url_tuple in self.frontier_save.values()]
-
-        for url in urls:
+        for url_tuple in self.frontier_save.values():
+            url = url_tuple[0]
             parsed = urlparse(url)
-            host = parsed.netloc.lower()
 
-            if not host:
-                continue
+            if not url in skipped:
+                unique_urls.add(self._normalize_url(parsed))
 
-            # Count unique pages (paths) per subdomain
-            path = parsed.path or "/"
-            subdomains[host].add(path)
+            host = parsed.netloc.lower()
+            if host:
+                # Count unique pages (paths) per subdomain
+                subdomains[host].add(parsed.path or "/")
 
         # Format output sorted alphabetically
         results = []
         for subdomain in sorted(subdomains.keys()):
             results.append(f"{subdomain}, {len(subdomains[subdomain])}")
 
-        return results
-    
+        return len(unique_urls), results
+
+    def unique_pages(self):
+        """Check for unique pages in the frontier save and returns the count of unique pages"""
+        return self._scan_frontier()[0]
+
+    def count_subdomains(self):
+        """
+        Count unique subdomains across ALL allowed domains.
+        Returns: list of strings like "subdomain, count"
+        """
+        return self._scan_frontier()[1]
+
     def generate_answer(self):
         """
         Output response to Answer.txt
         """
-        with open("Answer.txt", "w") as file:
-            file.write("Question 1: \n")
-            question_1 = self.unique_pages()
-            file.write(f"     There are {question_1} unique pages.\n")
-            file.write("Question 2: \n")
-            question_2 = self.longest_page()
-            file.write(f"     Longest page url is {question_2[0]} with {question_2[1]} words.\n")
-            file.write("Question 3: \n")
-            question_3 = self.common_words()
-            for token, freq in question_3.items():
-                file.write(f"     {token} -> {freq}\n")
-            file.write("Question 4: \n")
-            question_4 = self.count_subdomains()
-            for domain in question_4:
-                file.write(f"     {domain}\n")
+        # The token ranking runs in a separate thread while the frontier is scanned once for
+        # questions 1 and 4
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            common_words = executor.submit(self.common_words)
+            question_1, question_4 = self._scan_frontier()
+            question_3 = common_words.result()
+
+        question_2 = self.longest_page()
+        lines = ["Question 1: \n", f"     There are {question_1} unique pages.\n"]
+        lines.append("Question 2: \n")
+        lines.append(f"     Longest page url is {question_2[0]} with {question_2[1]} words.\n")
+        lines.append("Question 3: \n")
+        lines.extend(f"     {token} -> {freq}\n" for token, freq in question_3.items())
+        lines.append("Question 4: \n")
+        lines.extend(f"     {domain}\n" for domain in question_4)
+
+        # Write the whole answer to a temporary file in one call and swap it in, so an interrupted
+        # run never leaves a half written Answer.txt behind
+        with open("Answer.txt.tmp", "w") as file:
+            file.write("".join(lines))
+        os.replace("Answer.txt.tmp", "Answer.txt")
 
     def __del__(self):
         # Close the save file when the destructor is called to clean up
@@ -1,22 +1,44 @@
+import atexit
 import os
-import shelve
-from bs4 import BeautifulSoup
+import re
+from collections import Counter
 from utils import get_logger
-from threading import RLock
+from threading import Lock, RLock
 from utils.tokenizer import stop_words
+from utils.kvstore import KVStore, remove_store
+
+# Tokens are runs of ascii letters and digits. Each match is lowercased on its own so the page text
+# is never copied as a whole.
+_TOKEN_RE = re.compile(r"[A-Za-z0-9]+")
+_STOP = frozenset(stop_words)
 
 
 class Token:
     """
-    This class tracks the frequencies of tokens inside different urls. These frequencies are saved in the token save file.
+    This class tracks the frequencies of tokens inside different urls. These frequencies are kept in memory and
+    flushed to the token save file every FLUSH_EVERY pages.
+
+    The counts are split into SHARD_COUNT shards keyed by the hash of the token, each with its own lock, so
+    that workers can merge the counts of different pages at the same time.
     """
 
+    # Number of analyzed pages between two writes of the counter to the save file.
+    FLUSH_EVERY = 50
+    # Number of shards of the counter. Must be a power of two.
+    SHARD_COUNT = 16
+
     def __init__(self, config, restart):
         self.logger = get_logger("Token", "Token")
         self.config = config
-        self.counter: dict[str, int] = {}
+        # Only guards the flush and the page counter, the counts are guarded by their shard lock.
         self.lock = RLock()
 
+        # Each shard holds its token counts, the tokens whose count changed since the last flush and its lock.
+        self._shards: list[tuple[dict[str, int], set[str], Lock]] = [
+            ({}, set(), Lock()) for _ in range(self.SHARD_COUNT)
+        ]
+        self._pages_since_flush = 0
+
         if not os.path.exists(self.config.token_save_file) and not restart:
             # Save file does not exist, but request to load save.
             self.logger.info(
@@ -25,16 +47,21 @@ class Token:
         elif os.path.exists(self.config.token_save_file) and restart:
             # Save file does exists, but request to start from seed.
             self.logger.info(f"Found save file {self.config.token_save_file}, deleting it.")
-            os.remove(self.config.token_save_file)
+            remove_store(self.config.token_save_file)
         # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.token_save_file)
+        self.save = KVStore(self.config.token_save_file)
+        # The save file is flushed and closed at interpreter exit instead of in __del__, which may run after the
+        # save file has already been finalized
+        self._closed = False
+        atexit.register(self.close)
         if not restart:
-            self.counter = self.save
+            for token, count in self.save.items():
+                self._shard(token)[0][token] = count
 
     def analyze_response(self, resp):
         """
         Analyzes the responses by tokenizing the url content then saving the frequencies inside the save file.
-        Uses RLock to ensure that saving is thread safe.
+        Tokenizing runs without any lock, counting only locks the shards it updates and saving uses RLock.
 
         Parameters:
         - resp: response to be analyzed
@@ -42,33 +69,45 @@ class Token:
         Returns:
         - None
         """
-        with self.lock:
-            try:
-                res = self._tokenize_url_content(resp)
-                self._computeWordFrequencies(res)
-                self.logger.info(f"Successfully computed word frequencies url: {resp.url}.")
-            except Exception as e:
-                self.logger.error(f"Something went wrong with this url: {resp.url}. -- Error: {e}")
+        self.analyze_tokens(resp.url, self.tokenize_url_content(resp))
 
-    def _isAlnum(self, character: str) -> bool:
+    def analyze_tokens(self, url, tokens):
         """
-        Check if a character is alphanumeric.
+        Saves the frequencies of tokens that were already extracted from the url content.
 
         Parameters:
-        - character: str: Character to be checked.
+        - url: url the tokens were extracted from
+        - tokens: list[str]: tokens of the page
 
         Returns:
-        - bool: True if the character is alphanumeric, otherwise False.
+        - None
+        """
+        self.analyze_frequencies(url, Counter(tokens))
+
+    def analyze_frequencies(self, url, frequencies):
+        """
+        Saves token frequencies that were already counted from the url content. Lets the worker
+        count the tokens of a page once and share the counts with the other consumers.
+
+        Parameters:
+        - url: url the tokens were extracted from
+        - frequencies: dict[str, int]: number of times each token appears in the page
+
+        Returns:
+        - None
         """
         try:
-            character = character.lower()
-            return (ord("a") <= ord(character) <= ord("z")) or (
-                ord("0") <= ord(character) <= ord("9")
-            )
-        except:
-            return False
+            self._mergeWordFrequencies(frequencies)
+            self.logger.info(f"Successfully computed word frequencies url: {url}.")
+        except Exception as e:
+            self.logger.error(f"Something went wrong with this url: {url}. -- Error: {e}")
 
-    def _tokenize_url_content(self, response):
+        with self.lock:
+            self._pages_since_flush += 1
+            if self._pages_since_flush >= self.FLUSH_EVERY:
+                self._flush()
+
+    def tokenize_url_content(self, response):
         """
         Parse the HTML content of a response object and tokenize it.
 
@@ -78,21 +117,8 @@ class Token:
         Returns:
         - list[str]: List of tokens (alphanumeric sequences) from the content.
         """
-        tokens = []
-        currentWord = ""
-
         try:
-            soup = BeautifulSoup(response.raw_response.text, "html.parser")
-            text = soup.get_text()
-            for character in text:
-                if self._isAlnum(character):
-                    currentWord += character.lower()
-                else:
-                    if currentWord and not (currentWord in stop_words):
-                        tokens.append(currentWord)
-                        currentWord = ""
-            if currentWord and not (currentWord in stop_words):
-                tokens.append(currentWord)
+            tokens = list(self._iter_tokens(response))
 
         except Exception as e:
             print(f"An unexpected error occurred while processing the text: {e}")
@@ -100,28 +126,96 @@ class Token:
 
         return tokens
 
-    def _computeWordFrequencies(self, tokenList):
+    def count_url_tokens(self, response):
         """
-        Compute the frequency of each token.
+        Parse the HTML content of a response object and count its tokens, without keeping a list of
+        every token of the page.
 
         Parameters:
-        - tokenList: list[str]: List of tokens.
+        - response: Response: Response object from HTTP request.
 
         Returns:
-        - dict[str, int]: Dictionary mapping each token to its frequency count.
+        - Counter[str]: Number of times each token (alphanumeric sequence) appears in the content.
+        """
+        try:
+            frequencies = Counter(self._iter_tokens(response))
+
+        except Exception as e:
+            print(f"An unexpected error occurred while processing the text: {e}")
+            return Counter()
+
+        return frequencies
+
+    def _iter_tokens(self, response):
+        """
+        Yields the tokens of the page that aren't stop words. The text of the page is joined into one string
+        so words split by inline markup ("<b>W</b>ord") stay one token.
+        """
+        # local aliases, looked up once per page instead of once per token
+        stop = _STOP
+        for match in _TOKEN_RE.finditer(response.html_tree().text_content()):
+            word = match.group().lower()
+            if word not in stop:
+                yield word
+
+    def _shard(self, token):
+        """
+        Returns the shard that holds the count of a token.
+        """
+        return self._shards[hash(token) & (self.SHARD_COUNT - 1)]
+
+    def _mergeWordFrequencies(self, frequencies):
+        """
+        Merge the token frequencies of a page into the in-memory counter.
+        The save file is only updated by _flush.
+
+        Parameters:
+        - frequencies: dict[str, int]: number of times each token appears in the page.
+
+        Returns:
+        - None
+        """
+        buckets = [[] for _ in range(self.SHARD_COUNT)]
+        for token, count in frequencies.items():
+            buckets[hash(token) & (self.SHARD_COUNT - 1)].append((token, count))
+
+        for (counter, dirty, lock), bucket in zip(self._shards, buckets):
+            if not bucket:
+                continue
+            with lock:
+                for token, count in bucket:
+                    counter[token] = counter.get(token, 0) + count
+                    dirty.add(token)
+
+    def _flush(self):
+        """
+        Writes the tokens updated since the last flush to the save file and syncs it once.
         """
         with self.lock:
+            pending = {}
+            for counter, dirty, lock in self._shards:
+                with lock:
+                    for token in dirty:
+                        pending[token] = counter[token]
+                    dirty.clear()
+
             try:
-                for token in tokenList:
-                    if token in self.counter:
-                        self.counter[token] += 1
-                        self.save[token] += 1
-                    else:
-                        self.counter[token] = 1
-                        self.save[token] = 1
-                    self.save.sync()
+                self.save.update(pending)
+                self.save.sync()
+                self._pages_since_flush = 0
             except Exception as e:
-                print(f"An unexpected error occurred while updating save file: {e}")
-
-    def __del__(self):
-        self.save.close()
+                self.logger.error(f"An unexpected error occurred while updating save file: {e}")
+                # Mark the tokens as changed again so the next flush retries them
+                for token in pending:
+                    counter, dirty, lock = self._shard(token)
+                    with lock:
+                        dirty.add(token)
+
+    def close(self):
+        """Flushes the pending token counts and closes the save file. Safe to call more than once."""
+        with self.lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._flush()
+            self.save.close()
@@ -1,6 +1,7 @@
 from utils import get_logger
 from utils.tokenizer import tokenize_url_content, get_word_count_from_response
-import shelve
+from utils.kvstore import KVStore, remove_store
+import atexit
 import os
 
 import threading
@@ -19,7 +20,7 @@ class FindMax:
         # in the key 'url' and the count of the max words stored in the key 'max_words'
         self.curr_max: dict[str, str | int] = {}
 
-        # Initialize an instance of an RLock to handle concurrent access of shelves
+        # Initialize an instance of an RLock to handle concurrent access of the save file
         self.lock = threading.RLock()
 
         # save file stuff down here
@@ -31,54 +32,59 @@ class FindMax:
         elif os.path.exists(self.config.max_save_file) and restart:
             # Save file does exists, but request to start from seed.
             self.logger.info(f"Found save file {self.config.max_save_file}, deleting it.")
-            os.remove(self.config.max_save_file)
+            remove_store(self.config.max_save_file)
 
         # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.max_save_file)
+        self.save = KVStore(self.config.max_save_file)
+        # The save file is flushed and closed at interpreter exit instead of in __del__, which may run after the
+        # save file has already been finalized
+        self._closed = False
+        atexit.register(self.close)
 
         # If we are not restarting the crawler, call _parse_save_file to load self.curr_max
-        # with the data stored in our shelve and resume from there.
+        # with the data stored in our save file and resume from there.
         if not restart:
             self._parse_save_file()
 
-        # Otherwise, initialize the key-value pairs in the dictionary and update self.curr_max
+        # Otherwise, initialize the key-value pairs in the dictionary and persist them
         else:
-            self.save["url"] = "None"
-            self.save["max_words"] = 0
-            self.curr_max = self.save
+            self.curr_max = {"url": "None", "max_words": 0}
+            self._flush()
 
     def _parse_save_file(self):
         """
-        Updates self.curr_max with the set stored in the shelve. self.curr_max will be used in all
+        Updates self.curr_max with the values stored in the save file. self.curr_max will be used in all
         corresonding methods to access the dictionary.
         """
-        if 'url' not in self.save:
-            self.save['url'] = ""
-            self.save['max_words'] = 0
-
-        # Set self.curr_max to the instance stored in self.save
-        self.curr_max = self.save
+        # Copy the values stored in self.save into a plain dictionary so that comparisons do not
+        # hit the save file
+        self.curr_max = {
+            "url": self.save.get("url", ""),
+            "max_words": self.save.get("max_words", 0),
+        }
 
         # Log that we have found a save instance and are loading it
         self.logger.info(
             f"Current max detected - URL: {self.curr_max['url']}, Max words: {self.curr_max['max_words']}"
         )
 
-    def found_new_max(self, url, resp):
+    def found_new_max(self, url, resp, word_count=None):
         """
         Takes the url and the resp object and finds the number of words in the page, excluding HTML markup using
-        the tokenize_url_content util. Updates the self.curr_max attribute and the corresponding shelve
+        the tokenize_url_content util. Updates the self.curr_max attribute and the corresponding save file
         when a new max has been found. These maxes are then saved in the max save file.
+        word_count can be passed in by callers that already counted the words of the page to skip counting them again.
         """
 
-        # Obtain the amount of words stored in the response
-        word_count = get_word_count_from_response(resp)
+        # Obtain the amount of words stored in the response, unless the caller already did
+        if word_count is None:
+            word_count = get_word_count_from_response(resp)
 
         # If there were no words in the response, return False
         if not word_count:
             return False
 
-        # Using self.lock to ensure that concurrent shelve access is properly handled
+        # Using self.lock to ensure that concurrent save file access is properly handled
         # for multi-threaded crawls
         with self.lock:
             # If our current word_count is over the current max word count, update both the url
@@ -92,16 +98,28 @@ class FindMax:
                     f"Updated max words - New URL: {self.curr_max['url']}, New max words: {self.curr_max['max_words']}"
                 )
 
-                # Update the shelve and sync it
-                self.save = self.curr_max
-                self.save.sync()
+                # A new max is rare, so it is written to the save file right away
+                self._flush()
                 return True
 
         return False
 
-    def __del__(self):
-        # Close the save file when the destructor is called to clean up
-        self.save.close()
+    def _flush(self):
+        """
+        Writes self.curr_max to the save file and syncs it.
+        """
+        with self.lock:
+            self.save.update(self.curr_max)
+            self.save.sync()
+
+    def close(self):
+        """Flushes the pending max and closes the save file. Safe to call more than once."""
+        with self.lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._flush()
+            self.save.close()
 
 
 if __name__ == "__main__":
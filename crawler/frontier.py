@@ -20,6 +20,9 @@ class Frontier(object):
         self.to_be_downloaded = Queue()
         self.robot = robot
         self.lock = RLock()
+        # Raw 32 byte digests of every url hash in the save file. Checking this set avoids a lookup in the
+        # shelve file for every scraped link.
+        self._seen: set[bytes] = set()
 
         if not os.path.exists(self.config.save_file) and not restart:
             # Save file does not exist, but request to load save.
@@ -47,7 +50,8 @@ class Frontier(object):
         total_count = len(self.save)
         tbd_count = 0
         print("CHECK THIS length of self.save: ", len(self.save))
-        for url, completed in self.save.values():
+        for urlhash, (url, completed) in self.save.items():
+            self._seen.add(bytes.fromhex(urlhash))
             print("CHECK THIS url: ", url, "CHECK IF COMPLETED completed: ", completed)
             if not completed and is_valid(url, self.robot):
                 self.to_be_downloaded.put(url)
@@ -56,10 +60,13 @@ class Frontier(object):
             f"Found {tbd_count} urls to be downloaded from {total_count} " f"total urls discovered."
         )
 
-    def get_tbd_url(self):
-        """This function grabs the next url to be downloaded from the queue."""
+    def get_tbd_url(self, timeout=1.0):
+        """
+        This function grabs the next url to be downloaded from the queue. Blocks for up to timeout seconds
+        while the queue is empty and returns None if no url was added in that time.
+        """
         try:
-            url = self.to_be_downloaded.get_nowait()
+            url = self.to_be_downloaded.get(timeout=timeout)
             return url
         except Empty:
             return None
@@ -69,20 +76,46 @@ class Frontier(object):
         with self.lock:
             url = normalize(url)
             urlhash = get_urlhash(url)
-            if urlhash not in self.save:
+            digest = bytes.fromhex(urlhash)
+            if digest not in self._seen:
+                self._seen.add(digest)
                 self.save[urlhash] = (url, False)
                 # "saves" to save file
                 self.save.sync()
                 self.to_be_downloaded.put(url)
 
+    def add_urls(self, urls):
+        """
+        This function adds all the urls scraped from a page to the queue and saves them in the save file. The lock is taken once and the
+        save file is synced once for the whole batch instead of once per url.
+        """
+        with self.lock:
+            new_urls = {}
+            for url in urls:
+                url = normalize(url)
+                urlhash = get_urlhash(url)
+                digest = bytes.fromhex(urlhash)
+                if digest not in self._seen:
+                    self._seen.add(digest)
+                    new_urls[urlhash] = url
+            if not new_urls:
+                return
+            self.save.update((urlhash, (url, False)) for urlhash, url in new_urls.items())
+            # "saves" to save file
+            self.save.sync()
+            for url in new_urls.values():
+                self.to_be_downloaded.put(url)
+
     def mark_url_complete(self, url):
         """This function marks a url as completed and tracks it into the save file."""
         with self.lock:
             self.to_be_downloaded.task_done()
             urlhash = get_urlhash(url)
-            if urlhash not in self.save:
+            digest = bytes.fromhex(urlhash)
+            if digest not in self._seen:
                 # This should not happen.
                 self.logger.error(f"Completed url {url}, but have not seen it before.")
+                self._seen.add(digest)
 
             self.save[urlhash] = (url, True)
             self.save.sync()
@@ -1,13 +1,28 @@
 from urllib.robotparser import RobotFileParser
 from urllib.parse import urlparse
-from bs4 import BeautifulSoup
+from io import BytesIO
+from lxml import etree
 from utils.download import download
 from utils import get_logger, get_urlhash, normalize
+from utils.kvstore import KVStore, remove_store
 from threading import RLock
-import shelve
+from functools import lru_cache
 import os
 
 
+@lru_cache(maxsize=8192)
+def _base_url(url):
+    """Returns the scheme and host of a url. Cached since the same links are checked from many pages."""
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+@lru_cache(maxsize=4096)
+def _hash_base_url(base_url):
+    """Returns the url hash of a base url. Cached since every page of a host shares the same base url."""
+    return get_urlhash(normalize(base_url))
+
+
 class Robots:
     """
     This class will track the robots.txt for each base url. When a function like can_fetch, crawl_delay, or sitemaps is called, it will first check
@@ -32,16 +47,17 @@ class Robots:
         elif os.path.exists(self.config.robot_save_file) and restart:
             # Save file does exists, but request to start from seed.
             self.logger.info(f"Found save file {self.config.robot_save_file}, deleting it.")
-            os.remove(self.config.robot_save_file)
+            remove_store(self.config.robot_save_file)
         # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.robot_save_file)
+        self.save = KVStore(self.config.robot_save_file)
 
         if not restart:
             self._parse_save_file()
 
     def _parse_save_file(self):
         print("ROBOT: CHECK THIS length of self.save: ", len(self.save))
-        self._robots = self.save
+        # Keep the robots in a plain dict so lookups do not go to the save file
+        self._robots = dict(self.save.items())
         self.logger.info(f"Found {len(self.save)} robots saved.")
 
     def url_exists(self, url):
@@ -51,21 +67,34 @@ class Robots:
 
     def can_fetch(self, url):
         """Determine if the user agent can fetch the specified URL."""
-        self._addSite(url)
-        hashedUrl = self._getHashUrl(url)
+        hashedUrl = self._addSite(url)
 
         robot = self._robots[hashedUrl]
         if robot:
             return robot.can_fetch(self.userAgent, url)
         return True
 
+    def can_fetch_many(self, urls):
+        """
+        Determine for each url if the user agent can fetch it, in the same order as urls. The robots.txt of each
+        base url is only looked up once, since the links of a page mostly share a few hosts.
+        """
+        robots_by_base: dict[str, RobotFileParser | None] = {}
+        allowed = []
+        for url in urls:
+            baseUrl = self._getBaseUrl(url)
+            if baseUrl not in robots_by_base:
+                robots_by_base[baseUrl] = self._robots[self._addSite(url)]
+            robot = robots_by_base[baseUrl]
+            allowed.append(robot.can_fetch(self.userAgent, url) if robot else True)
+        return allowed
+
     def crawl_delay(self, url):
         """
         Returns the crawl delay for a specific url. If robots.txt does not exist,
         it will return 0.
         """
-        self._addSite(url)
-        hashedUrl = self._getHashUrl(url)
+        hashedUrl = self._addSite(url)
 
         robot = self._robots[hashedUrl]
         if robot:
@@ -76,8 +105,7 @@ class Robots:
 
     def sitemaps(self, url):
         """Retrieve list of sitemap URLs declared in the robots.txt."""
-        self._addSite(url)
-        hashedUrl = self._getHashUrl(url)
+        hashedUrl = self._addSite(url)
 
         robot = self._robots[hashedUrl]
         # Add this check for compatibility with Python 3.6
@@ -96,12 +124,16 @@ class Robots:
             )
             if resp and resp.raw_response and resp.raw_response.content:
                 xml_content = resp.raw_response.content
-                soup = BeautifulSoup(xml_content, "xml")
-                urls = soup.find_all("loc")
+                urls = []
+                # Stream the <loc> elements of any namespace and clear each one once read to bound memory
+                for _, elem in etree.iterparse(BytesIO(xml_content), tag="{*}loc", recover=True):
+                    if elem.text:
+                        urls.append(elem.text.strip())
+                    elem.clear()
 
                 self.logger.info(f"Found {len(urls)} from {resp.url}")
 
-                return [url.text for url in urls]
+                return urls
         return []
 
     def url_ends_with_xml(self, url):
@@ -111,20 +143,23 @@ class Robots:
 
     def _getBaseUrl(self, url):
         """Extract the base URL from the given URL."""
-        parsed = urlparse(url)
-        return f"{parsed.scheme}://{parsed.netloc}"
+        return _base_url(url)
 
     def _getHashUrl(self, url):
-        baseUrl = self._getBaseUrl(url)
-        robot_url = normalize(baseUrl)
-        return get_urlhash(robot_url)
+        return _hash_base_url(self._getBaseUrl(url))
 
     def _addSite(self, url):
-        """Add site to robots dictionary if it's not already present."""
+        """Add site to robots dictionary if it's not already present. Returns the hash of the site."""
+        baseUrl = self._getBaseUrl(url)
+        hashedUrl = _hash_base_url(baseUrl)
+        # Fast path without the lock since dict reads are atomic. Only a miss takes the lock, and checks
+        # again in case another thread added the site in the meantime.
+        if hashedUrl in self._robots:
+            return hashedUrl
         with self.lock:
-            hashedUrl = self._getHashUrl(url)
             if not hashedUrl in self._robots:
-                self._checkRobot(self._getBaseUrl(url))
+                self._checkRobot(baseUrl)
+        return hashedUrl
 
     def _checkRobot(self, url):
         """Read and parse the robots.txt for the specified base URL, ignoring SSL verification when neccessary."""
@@ -1,26 +1,77 @@
 from utils.tokenizer import tokenize_url_content, computeWordFrequencies
 from utils import get_logger
+from utils.kvstore import KVStore, remove_store
 from threading import RLock
+from collections import defaultdict
+from functools import lru_cache
+import atexit
 import os
-import shelve
 import hashlib
+import math
+import numpy as np
+
+try:
+    _popcount = int.bit_count
+except AttributeError:
+    # Fallback for Python versions before 3.10 which don't have int.bit_count
+    def _popcount(value):
+        return bin(value).count("1")
+
+
+@lru_cache(maxsize=131072)
+def _token_signs(token):
+    """
+    returns the 256 bits of the blake2b hash of a token as +1 for a 1 bit and -1 for a 0 bit, most significant bit first.
+    cached because the same tokens come up on most pages. the array is stored as int8 (256 bytes per token) to keep the
+    cache small, and is read only since it is shared between calls
+    """
+    # turns the token "word" into a 32 byte blake2b hash (faster than sha256 and we don't need a
+    # cryptographic hash here) and unpacks its raw bytes into 256 bits
+    digest = hashlib.blake2b(token.encode("utf-8"), digest_size=32).digest()
+    bits = np.unpackbits(np.frombuffer(digest, dtype=np.uint8))
+    signs = bits.astype(np.int8) * 2 - 1
+    signs.setflags(write=False)
+    return signs
 
 
 class SimHash:
     """
     This class will manage all the sim hashes for each url. If the page has not been accessed yet, the class will compute the respective sim hash and
-    save it in the save file. When we want to compare the similarity of a page,  we will iterate through all the hashes saved and if the similarity is
-    above a certain threshold, it will return True for being similar and False for being unsimilar.
+    save it in the save file. When we want to compare the similarity of a page,  we will iterate through the saved hashes that share a band with it and
+    if the similarity is above a certain threshold, it will return True for being similar and False for being unsimilar.
+    New hashes are buffered and written to the save file every FLUSH_EVERY pages.
     """
 
+    # Number of new hashes buffered before they are written to the save file
+    FLUSH_EVERY = 50
+
     def __init__(self, config, restart):
         """
-        initializes the simhash save files storing urls as keys and their hashes as values
+        initializes the simhash save files storing urls as keys and their hashes and token counts as values
         """
         self.logger = get_logger("Simhash", "Simhash")
         self.config = config
         self.lock = RLock()
-        self.hashes: dict[str, str] = {}
+        self.hashes: dict[str, int] = {}
+        # number of tokens of each saved page
+        self.token_counts: dict[str, int] = {}
+        # new (url, (hash, token count)) pairs that have not been written to the save file yet
+        self._pending: list[tuple[str, tuple[int, int]]] = []
+
+        # a page is similar to a saved one when its hash differs in at most this many of the 256 bits
+        self.threshold_bits = math.floor((1 - self.config.similarity_threshold) * 256)
+        # pages whose token counts differ by more than this fraction of the larger count are not compared
+        self.max_count_difference = 1 - self.config.similarity_threshold
+
+        # the 256 bits are split into threshold_bits + 1 bands and every url is indexed by the value of each
+        # of its bands. two hashes that differ in at most threshold_bits bits must have at least one identical
+        # band, so only the urls sharing a band with a page have to be compared with it
+        band_count = max(1, min(self.threshold_bits + 1, 256))
+        self.bands: list[tuple[int, int]] = []
+        for i in range(band_count):
+            start, end = i * 256 // band_count, (i + 1) * 256 // band_count
+            self.bands.append((start, (1 << (end - start)) - 1))
+        self.band_index: list[defaultdict[int, set[str]]] = [defaultdict(set) for _ in self.bands]
 
         if not os.path.exists(self.config.simhash_save_file) and not restart:
             # Save file does not exist, but request to load save.
@@ -30,121 +81,157 @@ class SimHash:
         elif os.path.exists(self.config.simhash_save_file) and restart:
             # Save file does exists, but request to start from seed.
             self.logger.info(f"Found save file {self.config.simhash_save_file}, deleting it.")
-            os.remove(self.config.simhash_save_file)
+            remove_store(self.config.simhash_save_file)
         # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.simhash_save_file)
+        self.save = KVStore(self.config.simhash_save_file)
+        # The save file is flushed and closed at interpreter exit instead of in __del__, which may run after the
+        # save file has already been finalized
+        self._closed = False
+        atexit.register(self.close)
         if not restart:
-            self.hashes = self.save
+            self._parse_save_file()
+
+    def _parse_save_file(self):
+        """
+        loads the saved hashes and token counts and indexes them
+        """
+        for url, saved in self.save.items():
+            # the save file stores (hash, token count) tuples with the hash as an int. anything else was saved by
+            # an older version of the crawler whose hashes can't be compared with the current ones
+            if not (isinstance(saved, tuple) and isinstance(saved[0], int)):
+                self.logger.error(
+                    f"Unsupported entry for {url} in {self.config.simhash_save_file}. Start the crawler with --restart."
+                )
+                raise ValueError(
+                    f"Unsupported simhash save file {self.config.simhash_save_file}, start the crawler with --restart"
+                )
+            saved_hash, token_count = saved
+            self.hashes[url] = saved_hash
+            self.token_counts[url] = token_count
+            self._index_hash(url, saved_hash)
+        self.logger.info(f"Found {len(self.hashes)} hashes in the save file.")
 
     def check_page_is_similar(self, response):
+        """
+        tokenizes the page and checks if it is similar to a saved page, see check_similar_tokens
+        """
+        return self.check_similar_tokens(response.url, tokenize_url_content(response))
+
+    def check_similar_tokens(self, resp_url, tokens):
+        """
+        counts the tokens of the page and checks if it is similar to a saved page, see check_similar_frequencies
+        """
+        return self.check_similar_frequencies(resp_url, computeWordFrequencies(tokens), len(tokens))
+
+    def check_similar_frequencies(self, resp_url, frequencies, token_count):
         """
         this function looks through all the hashes and tries to determine if there is a page that is above our similarity threshold
+        the token frequencies of the page are counted by the caller so they can be shared with the other consumers of the page
         if so --> return true for similarity
         else --> return false
         """
 
-        # tokenizes the page
-        page_hash = self._tokenize(response)
-
-        # hashes the page based off tokens
-        page_hash = self._hashify(page_hash)
-        resp_url = response.url
+        # hashes the page based off the token frequencies
+        page_hash = self._hashify(frequencies)
 
         # only one thread can work with simhash at a time this prevents any errors of synchronization from happening
         with self.lock:
 
-            # if there are hashes currently continue
-            if self.hashes:
-                for url, saved_hash in self.hashes.items():
-                    # compare the current pagehash with the other hashes in the simhash save file
-                    # if there it passes the similarity threshold then return true
-                    if (
-                        self._compare_hashes(page_hash, saved_hash)
-                        >= self.config.similarity_threshold
-                    ):
-                        self.logger.info(
-                            f"{resp_url} IS SIMILAR TO {url} WITH PERCENTAGE: {self._compare_hashes(page_hash, saved_hash)}"
-                        )
-                        return True
-
-                # since the hashes are not similar we will return false and store the page with its hash
-                self.hashes[resp_url] = page_hash
-                self.save[resp_url] = page_hash
-                self.logger.info(f"SimHash of {resp_url} is --> {page_hash}")
-                self.save.sync()
-                return False
-            # this will get run when there is currently nothing in the save file since the hashes are not similar
-            # we will return false and store the page with its hash
-            self.hashes[resp_url] = page_hash
-            self.save[resp_url] = page_hash
-            self.logger.info(f"SimHash of {resp_url} is --> {page_hash}")
-
-            self.save.sync()
+            # compare the current pagehash with the hashes in the simhash save file that share a band with it
+            # if the number of differing bits passes the similarity threshold then return true
+            for url in self._candidates(page_hash):
+                # pages with very different lengths can't be near duplicates, so skip them before comparing
+                saved_count = self.token_counts[url]
+                if abs(token_count - saved_count) > self.max_count_difference * max(
+                    token_count, saved_count
+                ):
+                    continue
+
+                saved_hash = self.hashes[url]
+                if _popcount(page_hash ^ saved_hash) <= self.threshold_bits:
+                    self.logger.info(
+                        f"{resp_url} IS SIMILAR TO {url} WITH PERCENTAGE: {self._compare_hashes(page_hash, saved_hash)}"
+                    )
+                    return True
+
+            # since the hashes are not similar (or there is nothing saved yet) we will return false
+            # and store the page with its hash
+            self._add_hash(resp_url, page_hash, token_count)
         return False
 
-    def _tokenize(self, response):
+    def _candidates(self, page_hash):
         """
-        tokenizes the url and store the word frequencies in a dictionary
-        and return the dictionary
+        returns the urls whose hashes share at least one band with the given hash
         """
-        tokens = tokenize_url_content(response)
-        token_frequencies = computeWordFrequencies(tokens)
-        return token_frequencies
+        candidates = set()
+        for (shift, mask), index in zip(self.bands, self.band_index):
+            bucket = index.get((page_hash >> shift) & mask)
+            if bucket:
+                candidates |= bucket
+        return candidates
+
+    def _index_hash(self, url, page_hash):
+        """
+        adds the url to the bucket of each band of its hash
+        """
+        for (shift, mask), index in zip(self.bands, self.band_index):
+            index[(page_hash >> shift) & mask].add(url)
+
+    def _add_hash(self, url, page_hash, token_count):
+        """
+        stores the hash and token count of a page in memory and buffers them for the simhash save file
+        """
+        with self.lock:
+            self.hashes[url] = page_hash
+            self.token_counts[url] = token_count
+            self._index_hash(url, page_hash)
+            self.logger.info(f"SimHash of {url} is --> {page_hash:064x}")
+            self._pending.append((url, (page_hash, token_count)))
+            if len(self._pending) >= self.FLUSH_EVERY:
+                self._flush()
+
+    def _flush(self):
+        """
+        writes the buffered hashes to the simhash save file and syncs it once
+        """
+        with self.lock:
+            self.save.update(self._pending)
+            self.save.sync()
+            self._pending.clear()
 
     def _hashify(self, token_freq_dict):
         """
         returns the hash of the current page based of the tokens dictionary
         """
         try:
-            # intiializes the vector with 256 0's as bits
-            vector = [0] * 256
+            # intiializes the vector with 256 0's, one per bit of the hash
+            vector = np.zeros(256, dtype=np.int64)
             for token, freq in token_freq_dict.items():
-                # turns the token "word" into a hash by encoding the token first
-                # and then converts the encodign into a sha256 hash
-                # and then gets the hexadecimal representation of it and turning it into an integer and storing it
-                hash_hex = int(hashlib.sha256(token.encode("utf-8")).hexdigest(), 16)
-                for i in range(256):
-                    # this checks each bit in the current hash, if it's a 1 then we add update the vector by incrementing
-                    # the ith value by 1
-                    # this is done by shifting the bit by i times
-                    bit = (hash_hex >> i) & 1
-                    vector[i] += freq if bit == 1 else -freq
-
-            # checks the position of each vector if the vector[i] is positive
-            # then we add 1 to the simhash and we shift left
-            # we are ultimately building the simhash for the page and return it at the end
-            simhash = 0
-            for pos, count in enumerate(vector):
-                if count > 0:
-                    simhash |= 1 << pos
-
-            simhash_hash = f"{simhash:064x}"
-
-            return simhash_hash
+                # every 1 bit of the token hash adds the frequency to its position in the vector and every 0 bit subtracts it
+                vector += np.multiply(_token_signs(token), freq, dtype=np.int64)
+
+            # every positive position of the vector becomes a 1 bit in the simhash, packed back in the same order
+            simhash_bytes = np.packbits((vector > 0).astype(np.uint8)).tobytes()
+
+            return int.from_bytes(simhash_bytes, "big")
 
         except Exception as e:
             self.logger.error("Failed to compute hash: " + str(e))
 
     def _compare_hashes(self, hash1, hash2):
-        # XOR operator counting the bits that are the same and turning it into a zero
-        hash1 = int(hash1, 16)
-        hash2 = int(hash2, 16)
-        diff = hash1 ^ hash2
-
-        # inverting the bits making the 1 represent the bits that are the same
-        same_bits = ~diff
-
-        # using mask because the invert operator could add extra leading 1s past the original bit length
+        # XOR operator turns the bits that are the same into a zero, so the popcount of the result
+        # is the number of bits that differ
         bit_length = 256
-        mask = (1 << bit_length) - 1
-
-        # removes potential extra leading bits
-        same_bits = mask & same_bits
+        return 1 - _popcount(hash1 ^ hash2) / bit_length
 
-        return bin(same_bits).count("1") / bit_length
-
-    def __del__(self):
-        self.save.close()
+    def close(self):
+        """Flushes the pending hashes and closes the save file. Safe to call more than once."""
+        with self.lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._flush()
+            self.save.close()
 
 
 if __name__ == "__main__":
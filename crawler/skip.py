@@ -1,20 +1,42 @@
 from urllib.parse import urlparse
 from threading import RLock
+import atexit
 import os
-import shelve
 from utils import get_logger, get_urlhash, normalize
 
 
+def read_skip_log(filename):
+    """Yields the (url hash, url) pairs stored in a skip log file."""
+    with open(filename, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            # Ignore a line that was only partially written before the crawler stopped
+            if "\t" in line:
+                hashed_url, url = line.split("\t", 1)
+                yield hashed_url, url
+
+
 class Skip:
     """
-    This class keeps track of all the pages that are skipped and saves it all in a save file.
+    This class keeps track of all the pages that are skipped and saves it all in a save file. The save file is an
+    append-only log with one "hash<TAB>url" line per skipped url, which is fsynced every FSYNC_EVERY urls.
     """
 
+    # Number of skipped urls appended to the save file between two fsyncs
+    FSYNC_EVERY = 256
+    # Maximum number of raw urls remembered before the set is cleared
+    SEEN_RAW_LIMIT = 1_000_000
+
     def __init__(self, config, restart):
         self.logger = get_logger("Skip", "Skip")
         self.config = config
         self.lock = RLock()
-        self.skip_set: dict[str, str] = {}
+        # Raw 32 byte digests of the skipped url hashes, half the size of the hex strings
+        self.skip_set: set[bytes] = set()
+        # Raw urls that were already skipped, checked before normalizing and hashing a url
+        self._seen_raw: set[str] = set()
+        # Number of urls written since the last fsync
+        self._pending = 0
 
         if not os.path.exists(self.config.skip_save_file) and not restart:
             # Save file does not exist, but request to load save.
@@ -25,37 +47,80 @@ class Skip:
             # Save file does exists, but request to start from seed.
             self.logger.info(f"Found save file {self.config.skip_save_file}, deleting it.")
             os.remove(self.config.skip_save_file)
-        # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.skip_save_file)
 
         if not restart:
             self._parse_save_file()
 
+        # Open the save file for appending, or create one if it does not exist.
+        self.save = open(self.config.skip_save_file, "a", encoding="utf-8", buffering=1 << 20)
+        # The save file is closed at interpreter exit instead of in __del__, which may run after the file
+        # object has already been finalized
+        self._closed = False
+        atexit.register(self.close)
+
     def _parse_save_file(self):
-        self.skip_set = self.save
+        if os.path.exists(self.config.skip_save_file):
+            self.skip_set = {
+                bytes.fromhex(hashed_url)
+                for hashed_url, _ in read_skip_log(self.config.skip_save_file)
+            }
         self.logger.info(f"Found {len(self.skip_set)} skipped urls in the save file.")
 
     def add_url(self, url):
         """
         When there is a url to be skipped, it will first get the hash of the url and check if that hash already exists within our saves. If it does not,
-        it will add it to the dictionary of urls that we skip. Then the save files are synced.
+        it will add it to the set of url hashes that we skip and append it to the save file. The save file is synced every FSYNC_EVERY urls.
         """
-        hashed_url = self._getHashUrl(url)
-        with self.lock:
-            if hashed_url not in self.save:
-                self.save[hashed_url] = url
-                self.skip_set[hashed_url] = url
-                # "saves" to save file
-                self.save.sync()
+        self.add_urls((url,))
+
+    def add_urls(self, urls):
+        """
+        Skips several urls at once, see add_url. The lock is taken once and the new lines are written to the save file in a single call.
+        """
+        # Urls that were skipped before with the exact same string don't need to be normalized and hashed again.
+        # The hashing happens outside of the lock.
+        hashed_urls = [(url, self._getHashUrl(url)) for url in urls if url not in self._seen_raw]
+        if not hashed_urls:
+            return
 
+        lines = []
+        with self.lock:
+            if len(self._seen_raw) >= self.SEEN_RAW_LIMIT:
+                self._seen_raw.clear()
+            for url, hashed_url in hashed_urls:
+                self._seen_raw.add(url)
+                digest = bytes.fromhex(hashed_url)
+                if digest in self.skip_set:
+                    continue
+                self.skip_set.add(digest)
+                lines.append(f"{hashed_url}\t{url}\n")
                 self.logger.info(
                     f"Skipping {url}. There are now {len(self.skip_set)} skipped urls in the save file."
                 )
+            if not lines:
+                return
+            self.save.write("".join(lines))
+            self._pending += len(lines)
+            if self._pending >= self.FSYNC_EVERY:
+                self._sync()
+
+    def _sync(self):
+        """Flushes the buffered lines of the save file and fsyncs it."""
+        with self.lock:
+            self.save.flush()
+            os.fsync(self.save.fileno())
+            self._pending = 0
 
     def _getHashUrl(self, url):
         """Gets the url hash for a certain url."""
         url = normalize(url)
         return get_urlhash(url)
 
-    def __del__(self):
-        self.save.close()
+    def close(self):
+        """Syncs and closes the save file. Safe to call more than once."""
+        with self.lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._sync()
+            self.save.close()
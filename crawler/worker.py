@@ -3,9 +3,16 @@ from threading import Thread
 from inspect import getsource
 from utils.download import download, prep_download
 from utils import get_logger
-from utils.tokenizer import get_word_count_from_response
 import scraper
-import time
+
+# basic check for requests in scraper, done once when the module is imported instead of for every worker
+_SCRAPER_SRC = getsource(scraper)
+assert not any(
+    req in _SCRAPER_SRC for req in ("from requests import", "import requests")
+), "Do not use requests in scraper.py"
+assert not any(
+    req in _SCRAPER_SRC for req in ("from urllib.request import", "import urllib.request")
+), "Do not use urllib.request in scraper.py"
 
 
 class Worker(Thread):
@@ -19,25 +26,19 @@ class Worker(Thread):
         self.max = m_max
         self.token = token
         self.skip = skip
-        # basic check for requests in scraper
-        assert {
-            getsource(scraper).find(req) for req in {"from requests import", "import requests"}
-        } == {-1}, "Do not use requests in scraper.py"
-        assert {
-            getsource(scraper).find(req)
-            for req in {"from urllib.request import", "import urllib.request"}
-        } == {-1}, "Do not use urllib.request in scraper.py"
+        # Maximum size of a page in bytes, pages with a larger content-length are skipped
+        self.max_bytes = config.max_file_size * 1048576
         super().__init__(daemon=True)
 
     def run(self):
         while True:
+            # Blocks until a url is available, so idle workers do not poll the frontier
             tbd_url = self.frontier.get_tbd_url()
             # This checks for any next to be downloaded URLs that are obtained after we parse the existing pages
             if not tbd_url:
                 # self.logger.info("Frontier is empty. Stopping Crawler.")
                 # print("++++++++ (worker.py) The frontier is empty and there were no tbd urls")
                 # break
-                time.sleep(0.1) 
                 continue
 
             # politeness manager here
@@ -65,25 +66,30 @@ class Worker(Thread):
                 continue
 
             # Another check for content length after we have grabbed the content. If the file content is above a certain threshold then we will
-            # skip the url.
-            if (
-                resp.raw_response.headers
-                and resp.raw_response.headers.get("content-length")
-                and float(resp.raw_response.headers.get("content-length"))
-                > self.config.max_file_size * 1048576
-            ):
+            # skip the url. Pages sent without a content-length header (or with a compressed one) are measured from the content
+            # itself, so a large page is never parsed.
+            headers = resp.raw_response.headers or {}
+            content_length = headers.get("content-length")
+            content_length = float(content_length) if content_length else 0.0
+            if content_length <= self.max_bytes:
+                content_length = max(content_length, len(resp.raw_response.content or b""))
+            if content_length > self.max_bytes:
                 self.logger.info(
-                    f"Skipping {tbd_url}. File size threshold exceeded {self.config.max_file_size * 1048576} with {float(resp.raw_response.headers.get('content-length'))}"
+                    f"Skipping {tbd_url}. File size threshold exceeded {self.max_bytes} with {content_length}"
                 )
                 self.skip.add_url(tbd_url)
                 self.frontier.mark_url_complete(tbd_url)
                 continue
 
+            # Counts the tokens of the page once. The counts are shared by the word count, the simhash and the token frequencies.
+            frequencies = self.token.count_url_tokens(resp)
+            word_count = sum(frequencies.values())
+
             # Checks the number of words a url has. If it is above a certain threshold, then we will skip the url.
             if (
                 not self.robot.url_ends_with_xml(tbd_url)
-                and get_word_count_from_response(resp)
-                and get_word_count_from_response(resp) < self.config.low_information_value
+                and word_count
+                and word_count < self.config.low_information_value
             ):
                 self.logger.info(
                     f"Skipping {tbd_url}. Page has less than {self.config.low_information_value} words."
@@ -93,8 +99,8 @@ class Worker(Thread):
                 continue
 
             # Checks the simhash of the page. If it detects the page as similar to another one we already have, it will skip.
-            if not self.robot.url_ends_with_xml(tbd_url) and self.simhash.check_page_is_similar(
-                resp
+            if not self.robot.url_ends_with_xml(tbd_url) and self.simhash.check_similar_frequencies(
+                resp.url, frequencies, word_count
             ):
                 self.logger.info(f"Skipping {tbd_url}. Content is too similar.")
                 self.skip.add_url(tbd_url)
@@ -102,17 +108,16 @@ class Worker(Thread):
                 continue
 
             # Tracks the number of words in a certain page. If a new max is found we will log it.
-            if self.max.found_new_max(tbd_url, resp):
+            if self.max.found_new_max(tbd_url, resp, word_count):
                 self.logger.info(f"Found new max. Now storing: {tbd_url}")
 
             # Computes the token frequencies of the url and saves it in the token save file.
-            self.token.analyze_response(resp)
+            self.token.analyze_frequencies(resp.url, frequencies)
 
             self.logger.info(
                 f"Downloaded {tbd_url}, status <{resp.status}>, "
                 f"using cache {self.config.cache_server}."
             )
             scraped_urls = scraper.scraper(tbd_url, resp, self.robot)
-            for scraped_url in scraped_urls:
-                self.frontier.add_url(scraped_url)
+            self.frontier.add_urls(scraped_urls)
             self.frontier.mark_url_complete(tbd_url)
@@ -1,8 +1,45 @@
-import re
 from crawler.robots import Robots
+from functools import lru_cache
 from urllib.parse import urlparse
 from urllib.parse import urljoin
-from bs4 import BeautifulSoup
+from lxml import etree
+
+# Only urls within these domains (or their subdomains) are crawled
+_ALLOWED_DOMAINS = frozenset(
+    [
+        "ics.uci.edu",
+        "cs.uci.edu",
+        "informatics.uci.edu",
+        "stat.uci.edu",
+    ]
+)
+_ALLOWED_SUBDOMAIN_SUFFIXES = tuple(f".{domain}" for domain in _ALLOWED_DOMAINS)
+
+# Only urls with one of these schemes are crawled
+_ALLOWED_SCHEMES = frozenset(["http", "https"])
+
+# Paths ending with one of these file extensions are not crawled. Looked up in a frozenset with the
+# lowercased extension of the path, so the check is a single hash lookup
+_BAD_EXTENSIONS = frozenset(
+    [
+        "css", "js", "bmp", "gif", "jpg", "jpeg", "ico",
+        "png", "tif", "tiff", "mid", "mp2", "mp3", "mp4",
+        "wav", "avi", "mov", "mpeg", "ram", "m4v", "mkv", "ogg", "ogv", "pdf", "war",
+        "ps", "eps", "tex", "ppt", "pptx", "doc", "docx", "xls", "xlsx", "names",
+        "data", "dat", "exe", "bz2", "tar", "msi", "bin", "7z", "psd", "dmg", "iso", "ppsx",
+        "epub", "dll", "cnf", "tgz", "sha1",
+        "thmx", "mso", "arff", "rtf", "jar", "csv",
+        "rm", "smil", "wmv", "swf", "wma", "zip", "rar", "gz",
+    ]
+)
+
+
+@lru_cache(maxsize=8192)
+def _parsed(url):
+    """
+    returns urlparse(url). cached since the same links come back from many pages (navigation menus, sitemaps)
+    """
+    return urlparse(url)
 
 
 def scraper(url, resp, robot: Robots):
@@ -12,17 +49,26 @@ def scraper(url, resp, robot: Robots):
     # If it finds any urls after parsing the url, it will return only the valid links
     if sitemaps:
         # Iterate through the list of links in site map and only return links thatt are valid and met the requirements
-        return [link for link in sitemaps if is_valid(link, robot)]
+        return filter_valid(sitemaps, robot)
 
     links = extract_next_links(url, resp)
 
-    # Res is created by iterating through links and determining if it's valid through is_valid
-    # and appends the links found in robots.txt
-    res = [link for link in links if is_valid(link, robot)] + robot.sitemaps(resp.url)
+    # Res is created by only keeping the valid links (see filter_valid) and appends the links found in robots.txt
+    res = filter_valid(links, robot) + robot.sitemaps(resp.url)
 
     return res
 
 
+def filter_valid(links, robot: Robots):
+    """
+    returns the links that is_valid would accept, in their original order. the links are deduplicated first
+    since menus repeat the same links, and the robots.txt checks of all the links that pass the cheap checks
+    are done in one batch
+    """
+    candidates = [link for link in dict.fromkeys(links) if _passes_url_checks(link)]
+    return [link for link, allowed in zip(candidates, robot.can_fetch_many(candidates)) if allowed]
+
+
 def extract_next_links(url, resp):
 
     # Detect and avoid dead URLs that return a 200 status but no data (click here to see what the different HTTP status codes meanLinks to an external site.)
@@ -43,57 +89,76 @@ def extract_next_links(url, resp):
             # Return that redirect link by joining the the subdomain in Location with the parent URL
             return [urljoin(resp.url, resp.headers["Location"])]
 
-    soup = BeautifulSoup(resp.raw_response.content, "html.parser", from_encoding="utf-8")
+    # Parses the page with lxml's C parser, or reuses the tree the tokenizer already parsed. A page without
+    # any markup has no links.
+    try:
+        tree = resp.html_tree()
+    except etree.ParserError:
+        return hyperlink_list
 
-    # finds all the anchor tags and href links and turns them all into absolute urls
-    all_links = soup.find_all("a")
-    for link in all_links:
-        href = link.get("href")
-        if href:
-            if is_relative(href):
-                href = urljoin(url, href)
-            hyperlink_list.append(href)
+    # the page url is parsed once, so the common kinds of links can be made absolute by concatenating strings
+    base = _parsed(url)
+    scheme = base.scheme
+    origin = f"{scheme}://{base.netloc}"
+
+    # local aliases, looked up once instead of on every link
+    append = hyperlink_list.append
+    join = urljoin
+
+    # finds all the anchor tags that have an href and turns the links into absolute urls. anchors without an href
+    # are filtered out by lxml's path matching. urljoin is only used for the links that aren't absolute, scheme
+    # relative ("//host/path") or a plain absolute path ("/path")
+    # the fragment is dropped from every link since it points into the same page, so "page#a" and "page#b"
+    # are not crawled as two pages
+    for link in tree.iterfind(".//a[@href]"):
+        href = link.attrib["href"].partition("#")[0]
+        if not href:
+            continue
+        if href.startswith(("http://", "https://")):
+            pass
+        elif href.startswith("//"):
+            href = f"{scheme}:{href}"
+        elif href.startswith("/") and "/." not in href:
+            href = origin + href
+        else:
+            href = join(url, href)
+        append(href)
     return hyperlink_list
 
 
-def is_relative(url):
-    """
-    returns whether or not the url is a relative url
-    """
-    return not urlparse(url).netloc
-
-
 def is_valid(url, robot: Robots):
     # Decide whether to crawl this url or not.
     # If you decide to crawl it, return True; otherwise return False.
     # There are already some conditions that return False.
+    # The robots check is done last since it is the most expensive one.
+    return _passes_url_checks(url) and robot.can_fetch(url)
+
+
+def _passes_url_checks(url):
+    """
+    returns whether the url passes every check of is_valid except for the robots.txt one
+    """
+    # Most rejected links use another scheme (mailto:, javascript:, tel:...), which is found without
+    # parsing the url
+    if not url[:8].lower().startswith(("http://", "https://")):
+        return False
+
     try:
         # Obtain a parsed version of the url to easily access it's individual components
-        parsed = urlparse(url)
+        parsed = _parsed(url)
 
         # Check if the scheme isn't http or https. If it isn't, the url isn't valid
-        if parsed.scheme not in set(["http", "https"]):
+        if parsed.scheme not in _ALLOWED_SCHEMES:
             return False
 
-        # Check the netloc of the parsed url to obtain the authority. Split by . to easily
-        # access the individual components
+        # Check the netloc of the parsed url to obtain the authority. If it isn't one of the allowed
+        # domains or one of their subdomains, the url isn't valid.
         domain = parsed.netloc
-        dotlist = domain.split(".")
-
-        # Check if the last 3 domain labels are within the set. If they aren't within the set,
-        # the url isn't valid.
-        if not ".".join(dotlist[-3:]) in set(
-            [
-                ".ics.uci.edu",
-                ".cs.uci.edu",
-                ".informatics.uci.edu",
-                ".stat.uci.edu",
-                "ics.uci.edu",
-                "cs.uci.edu",
-                "informatics.uci.edu",
-                "stat.uci.edu",
-            ]
-        ):
+        if not (domain in _ALLOWED_DOMAINS or domain.endswith(_ALLOWED_SUBDOMAIN_SUFFIXES)):
+            return False
+
+        # Checks to ensure that the file extension isn't disallowed. If it is, the url isn't valid.
+        if parsed.path.rpartition(".")[2].lower() in _BAD_EXTENSIONS:
             return False
 
         # Our reddit upvote system for the code
@@ -103,22 +168,7 @@ def is_valid(url, robot: Robots):
        
         """
 
-        # Check that the user object can fetch the url. If not, the url isn't valid.
-        if not robot.can_fetch(url):
-            return False
-
-        # Checks to ensure that the file extension isn't disallowed. If it is, the url isn't valid.
-        return not re.match(
-            r".*\.(css|js|bmp|gif|jpe?g|ico"
-            + r"|png|tiff?|mid|mp2|mp3|mp4"
-            + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf|war"
-            + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
-            + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso|ppsx"
-            + r"|epub|dll|cnf|tgz|sha1"
-            + r"|thmx|mso|arff|rtf|jar|csv"
-            + r"|rm|smil|wmv|swf|wma|zip|rar|gz)$",
-            parsed.path.lower(),
-        )
+        return True
 
     except TypeError:
         print("TypeError for ", parsed)
@@ -0,0 +1,100 @@
+import os
+import pickle
+import sqlite3
+from threading import RLock
+
+
+class KVStore(object):
+    """
+    A small dict-like store backed by sqlite3, used as a drop-in replacement for shelve.
+    Keys are stored as plain text and only values are pickled, with the highest protocol available.
+    The database runs in WAL mode so readers do not block the writer, and writes are grouped into
+    one transaction until sync() is called.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = RLock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS kv(k TEXT PRIMARY KEY, v BLOB)")
+        self.conn.commit()
+
+    def __getitem__(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT v FROM kv WHERE k = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return pickle.loads(row[0])
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO kv(k, v) VALUES (?, ?)",
+                (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)),
+            )
+
+    def __delitem__(self, key):
+        with self.lock:
+            cursor = self.conn.execute("DELETE FROM kv WHERE k = ?", (key,))
+        if not cursor.rowcount:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM kv WHERE k = ?", (key,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT k FROM kv")]
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def items(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT k, v FROM kv").fetchall()
+        return [(key, pickle.loads(value)) for key, value in rows]
+
+    def update(self, other):
+        """Writes every key-value pair of a dict (or iterable of pairs) in a single statement."""
+        if hasattr(other, "items"):
+            other = other.items()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO kv(k, v) VALUES (?, ?)",
+                ((key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)) for key, value in other),
+            )
+
+    def sync(self):
+        """Commits the pending writes."""
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+def remove_store(filename):
+    """Deletes a store together with the WAL files sqlite keeps next to it."""
+    for path in (filename, f"{filename}-wal", f"{filename}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
@@ -1,4 +1,10 @@
+import codecs
 import pickle
+import re
+from lxml import etree, html
+
+# Charset declared by a <meta charset=...> or <meta http-equiv="Content-Type" content="...; charset=..."> tag
+_META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset=["']?([A-Za-z0-9_.:-]+)""", re.IGNORECASE)
 
 class Response(object):
     def __init__(self, resp_dict):
@@ -12,3 +18,53 @@ class Response(object):
                 None)
         except TypeError:
             self.raw_response = None
+        self._html_tree = None
+
+    def html_tree(self):
+        """
+        Parses the content of the page with lxml the first time it is called and returns the same tree
+        afterwards, so the tokenizer and the link extraction share one parse of the page.
+        Raises lxml.etree.ParserError if the page has no markup or looks like a binary file.
+        """
+        if self._html_tree is None:
+            content = self.raw_response.content
+            if looks_binary(content):
+                raise etree.ParserError("Document looks like a binary file")
+            # The page is decoded once with its real charset. Given bytes without a <meta> charset, lxml would
+            # decode them as latin-1 and garble every non ascii character of a utf-8 page.
+            text = content.decode(self.page_encoding(), errors="replace")
+            # document_fromstring always returns the <html> root. fromstring returns the only element of a page
+            # with a single element in its body, which ".//a" searches from that element would not match
+            try:
+                self._html_tree = html.document_fromstring(text)
+            except ValueError:
+                # lxml refuses a str that still carries an <?xml ... encoding=...?> declaration, so the text is parsed
+                # from utf-8 bytes. The parser is created here since lxml parsers can't be shared between workers.
+                parser = html.HTMLParser(encoding="utf-8")
+                self._html_tree = html.document_fromstring(text.encode("utf-8"), parser=parser)
+        return self._html_tree
+
+    def page_encoding(self):
+        """
+        Returns the charset of the page: the one of the Content-Type header, else the one of a <meta> tag
+        near the start of the page, else utf-8.
+        """
+        content_type = (self.raw_response.headers or {}).get("content-type", "")
+        if "charset=" in content_type.lower() and self.raw_response.encoding:
+            encoding = self.raw_response.encoding
+        else:
+            match = _META_CHARSET_RE.search(self.raw_response.content[:1024])
+            encoding = match.group(1).decode("ascii") if match else "utf-8"
+        try:
+            return codecs.lookup(encoding).name
+        except LookupError:
+            return "utf-8"
+
+
+def looks_binary(content):
+    """
+    Sniffs the first bytes of a page for NUL bytes, so binary files served as html are rejected before being
+    parsed. Anything else, including plain text and html without a doctype or <html> tag, is left to lxml.
+    """
+    # Text never contains NUL bytes, binary files usually contain a lot of them
+    return content[:1024].count(b"\x00") > 4